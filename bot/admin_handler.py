@@ -1,4 +1,5 @@
 import os
+import shutil
 from datetime import datetime
 from pathlib import Path
 
@@ -47,14 +48,31 @@ class AdminHandler:
         return (False, '')  # Not an admin message
         
     def _save_new_system_prompt(self, prompt_text: str):
-        """EXACT COPY: Current atomic file operations with backup"""
+        """Atomic file update with backup: tmp write -> copy backup -> replace.
+
+        Порядок важен: канонический файл остаётся на месте вплоть до атомарного
+        os.replace, поэтому параллельные читатели никогда не видят его отсутствующим
+        (старый rename-затем-write оставлял такое окно).
+        """
         prompt_dir = Path('prompts')
         prompt_dir.mkdir(exist_ok=True)
         target = prompt_dir / 'system_prompt.txt'
+        # 1. Полностью записываем новый промпт во временный файл и fsync-аем его
+        tmp_file = prompt_dir / f'.tmp_{os.getpid()}'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(prompt_text)
+            f.flush()
+            os.fsync(f.fileno())
+        # 2. Бэкап делаем копированием, не переименованием
         if target.exists():
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            target.rename(prompt_dir / f'system_prompt_{timestamp}.txt')  # Backup
-        # Write new prompt
-        tmp_file = prompt_dir / f'.tmp_{os.getpid()}'
-        tmp_file.write_text(prompt_text, encoding='utf-8')
-        tmp_file.replace(target)  # Atomic replace 
\ No newline at end of file
+            shutil.copy2(target, prompt_dir / f'system_prompt_{timestamp}.txt')
+        # 3. Атомарная замена
+        os.replace(tmp_file, target)
+        # 4. fsync каталога фиксирует переименование на диске
+        if hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(prompt_dir, os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd) 
\ No newline at end of file
@@ -1,63 +1,221 @@
+import asyncio
+import contextlib
+import hashlib
+import queue
 import sqlite3
-from typing import List, Dict
+import time
+from calendar import timegm
+from collections import deque
+from typing import List, Dict, Deque, Tuple
 
 class HistoryManager:
+    # SQL-константы уровня класса: одни и те же интернированные строки на каждый
+    # вызов гарантируют попадание во внутренний кэш подготовленных выражений sqlite3
+    _SQL_INSERT = 'INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)'
+    _SQL_TRIM = '''DELETE FROM messages WHERE user_id = ? AND id <= (
+            SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET 20
+        )'''
+    _SQL_HISTORY = '''
+            SELECT timestamp, role, content FROM messages
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT 20
+        '''
+    _SQL_RESET = 'DELETE FROM messages WHERE user_id = ?'
+
+    # Размер пула читающих соединений: под WAL читатели работают параллельно
+    # с писателем, небольшого пула хватает на всплески одновременных запросов
+    _READ_POOL_SIZE = 3
+
     def __init__(self, db_path: str = 'conversation_history.db'):
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
+        # check_same_thread=False, чтобы соединение можно было разделять между потоками
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        # Сквозной кэш последних 20 сообщений: {user_id: deque[(unix_ts, message)]}
+        # Все записи идут через этот класс, поэтому кэш не может устареть.
+        self._cache: Dict[int, Deque[Tuple[float, Dict[str, str]]]] = {}
+        self._tune_connection(self.conn)
         self.init_db()
-    
+        # Пул читающих соединений: единственное разделяемое соединение
+        # сериализовало бы читателей и писателя на общем мьютексе sqlite.
+        # Для ':memory:' пул не создаём — каждое соединение было бы отдельной базой.
+        self._read_pool: queue.Queue = queue.Queue()
+        if db_path != ':memory:':
+            for _ in range(self._READ_POOL_SIZE):
+                reader = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+                self._tune_connection(reader)
+                self._read_pool.put(reader)
+
+    def _tune_connection(self, conn: sqlite3.Connection):
+        """Настраивает PRAGMA под частые мелкие записи.
+
+        WAL позволяет читателям (get_history) работать параллельно с писателем
+        и сокращает количество fsync на коммит; synchronous=NORMAL безопасен в WAL.
+        """
+        if self.db_path == ':memory:':
+            return  # для базы в памяти WAL не имеет смысла
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-20000')  # ~20 МБ кэша страниц
+        conn.execute('PRAGMA mmap_size=268435456')  # 256 МБ mmap
+
+    @contextlib.contextmanager
+    def _reader(self):
+        """Выдаёт соединение для чтения из пула (или писателя для ':memory:')."""
+        if self.db_path == ':memory:':
+            yield self.conn
+            return
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
     def init_db(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS messages (
+        # timestamp хранится как целое unix-время: компактнее TEXT-даты и
+        # сравнивается одним целочисленным опкодом вместо строковой коллации
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            timestamp INTEGER DEFAULT (strftime('%s', 'now')),
             role TEXT,
             content TEXT
         )''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON messages (user_id)')
+        # Составной индекс: и обрезка истории, и выборка последних 20 сообщений
+        # становятся чистым сканом по индексу без сортировки
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_user_id_id ON messages (user_id, id DESC)')
+        # Покрывает фильтр user_id + timestamp и порядок сортировки get_history
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_user_time ON messages (user_id, timestamp DESC, id DESC)')
+        # Одиночный idx_user_id стал избыточен: оба составных индекса начинаются с user_id
+        self.conn.execute('DROP INDEX IF EXISTS idx_user_id')
+        # Кэш ответов LLM: ключ — 16-байтовый дайджест текста запроса, а не сама
+        # строка, поэтому индекс компактный и сравнения ключей дешёвые
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+            key BLOB PRIMARY KEY,
+            response TEXT
+        )''')
         self.conn.commit()
-    
+
     def add_message(self, user_id: int, role: str, content: str):
-        cursor = self.conn.cursor()
-        cursor.execute('INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)', (user_id, role, content))
-        self.conn.commit()
-        # Limit to 20: delete oldest if over
-        cursor.execute('SELECT COUNT(*) FROM messages WHERE user_id = ?', (user_id,))
-        count = cursor.fetchone()[0]
-        if count > 20:
-            cursor.execute('''DELETE FROM messages WHERE id IN (
-                SELECT id FROM messages WHERE user_id = ? ORDER BY timestamp ASC LIMIT ?
-            )''', (user_id, count - 20))
-            self.conn.commit()
-    
+        with self.conn:  # одна транзакция: вставка + обрезка истории
+            self.conn.execute(self._SQL_INSERT, (user_id, role, content))
+            self._trim_history(user_id)
+        self._cache_put(user_id, role, content)
+
+    def add_turn(self, user_id: int, user_text: str, bot_text: str):
+        """Записывает пару сообщений (вопрос пользователя + ответ бота) одной транзакцией.
+
+        Вдвое меньше коммитов (fsync), чем при двух отдельных вызовах add_message.
+        """
+        with self.conn:
+            self.conn.executemany(
+                self._SQL_INSERT,
+                [(user_id, 'user', user_text), (user_id, 'bot', bot_text)])
+            self._trim_history(user_id)
+        self._cache_put(user_id, 'user', user_text)
+        self._cache_put(user_id, 'bot', bot_text)
+
+    def _cache_put(self, user_id: int, role: str, content: str):
+        # Дописываем только в уже прогретый кэш: частично заполненная deque
+        # выглядела бы как полная история. Холодный кэш наполнит get_history.
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            entry.append((time.time(), {'role': role, 'content': content}))
+
+    def _trim_history(self, user_id: int):
+        # Limit to 20: удаляем всё старше 21-й по свежести записи одним запросом.
+        # Если записей меньше 21, подзапрос вернёт NULL и DELETE ничего не тронет.
+        self.conn.execute(self._SQL_TRIM, (user_id, user_id))
+
     def get_history(self, user_id: int) -> List[Dict[str, str]]:
         """Возвращает последние 20 сообщений за последний час."""
-        from datetime import datetime, timedelta  # локальный импорт, чтобы избежать циклов
+        # Пороговое время – ровно час назад от текущего момента
+        threshold_time = time.time() - 3600
 
-        # Вычисляем пороговое время – ровно час назад от текущего момента
-        threshold_time = (datetime.utcnow() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+        entry = self._cache.get(user_id)
+        if entry is None:
+            entry = self._load_cache(user_id)
 
-        cursor = self.conn.cursor()
+        # Часовое окно применяется на выдаче, кэш хранит последние 20 сообщений
+        return [message for ts, message in entry if ts >= threshold_time]
 
-        # Получаем не более 20 последних сообщений, отправленных за последний час
-        cursor.execute('''
-            SELECT role, content FROM messages
-            WHERE user_id = ? AND timestamp >= ?
-            ORDER BY timestamp DESC, id DESC
-            LIMIT 20
-        ''', (user_id, threshold_time))
+    def _load_cache(self, user_id: int) -> Deque[Tuple[float, Dict[str, str]]]:
+        """Прогревает кэш пользователя последними 20 сообщениями из SQLite."""
+        with self._reader() as conn:
+            rows = conn.execute(self._SQL_HISTORY, (user_id,)).fetchall()
+
+        entry: Deque[Tuple[float, Dict[str, str]]] = deque(maxlen=20)
+        # Переворачиваем, чтобы хранить в хронологическом (старое → новое) порядке
+        for ts_raw, role, content in reversed(rows):
+            entry.append((self._parse_timestamp(ts_raw), {'role': role, 'content': content}))
+
+        self._cache[user_id] = entry
+        return entry
+
+    @staticmethod
+    def _parse_timestamp(ts_raw) -> float:
+        """Приводит timestamp из базы к unix-времени.
+
+        Новые базы хранят целое unix-время; в старых колонка была DATETIME
+        с текстом 'YYYY-MM-DD HH:MM:SS' (UTC) — поддерживаем оба формата.
+        """
+        if isinstance(ts_raw, (int, float)):
+            return float(ts_raw)
+        try:
+            return timegm(time.strptime(ts_raw, '%Y-%m-%d %H:%M:%S'))
+        except (TypeError, ValueError):
+            return 0.0  # нечитаемый timestamp считаем устаревшим
+
+    # --- Кэш ответов LLM -------------------------------------------------------
+
+    @staticmethod
+    def _llm_cache_key(message_text: str) -> bytes:
+        # BLAKE2b аппаратно ускорен, 16 байт достаточно против коллизий
+        return hashlib.blake2b(message_text.encode('utf-8'), digest_size=16).digest()
 
-        rows = cursor.fetchall()
+    def get_cached_response(self, message_text: str):
+        """Возвращает закэшированный ответ LLM для текста запроса или None."""
+        with self._reader() as conn:
+            row = conn.execute(
+                'SELECT response FROM llm_cache WHERE key = ?',
+                (self._llm_cache_key(message_text),)).fetchone()
+        return row[0] if row else None
+
+    def cache_response(self, message_text: str, response: str):
+        """Сохраняет ответ LLM под хэш-ключом текста запроса."""
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, response) VALUES (?, ?)',
+                (self._llm_cache_key(message_text), response))
+
+    # --- Асинхронные обёртки ---------------------------------------------------
+    # Выносят блокирующие вызовы sqlite (fsync, WAL-checkpoint) в пул потоков,
+    # чтобы не останавливать event loop при одновременных пользователях.
+
+    async def aget_history(self, user_id: int) -> List[Dict[str, str]]:
+        return await asyncio.to_thread(self.get_history, user_id)
+
+    async def aadd_message(self, user_id: int, role: str, content: str):
+        await asyncio.to_thread(self.add_message, user_id, role, content)
+
+    async def aadd_turn(self, user_id: int, user_text: str, bot_text: str):
+        await asyncio.to_thread(self.add_turn, user_id, user_text, bot_text)
 
-        # Переворачиваем, чтобы вернуть в хронологическом (старое → новое) порядке
-        return [{'role': row[0], 'content': row[1]} for row in reversed(rows)]
-    
     def reset_history(self, user_id: int):
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
+        self.conn.execute(self._SQL_RESET, (user_id,))
         self.conn.commit()
-    
-    def __del__(self):
-        self.conn.close() 
\ No newline at end of file
+        self._cache.pop(user_id, None)
+
+    def close(self):
+        """Явно закрывает все соединения; вызывать при остановке бота.
+
+        Закрытие в __del__ срабатывало на финализации интерпретатора, когда
+        модули могут быть уже выгружены, и оставляло WAL без чекпоинта.
+        """
+        if self.db_path != ':memory:':
+            # Сбрасываем WAL в основной файл, чтобы он не рос между перезапусками
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.close()
+        while not self._read_pool.empty():
+            self._read_pool.get_nowait().close()
@@ -3,6 +3,14 @@ from dotenv import load_dotenv
 from bot.telegram_handler import TelegramHandler
 
 def main():
+    # uvloop (libuv) заметно быстрее дефолтного selector-цикла на сокетных
+    # нагрузках; опционален — на Windows или без пакета работаем как раньше
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     # Load .env file variables if present
     load_dotenv()
     telegram_token = os.getenv('TELEGRAM_TOKEN')
@@ -1,5 +1,45 @@
+import functools
 import re
 
+# Паттерны компилируются один раз при импорте: внутренний кэш модуля re может
+# вытесняться другими пользователями regex в процессе, вызывая перекомпиляцию
+_HEADER_RE = re.compile(r'^#{1,6}\s*', re.MULTILINE)
+_BOLD4_RE = re.compile(r'^\*{4}\s*(.+)', re.MULTILINE)
+_ASKED_SOURCES_RE = re.compile(r'(источник|sources?)', re.IGNORECASE)
+_SOURCES_RE = re.compile(r'\(\s*(источник\w*|sources?)\s*[^)]*\)', re.IGNORECASE)
+_RU_SUPPORT_RE = re.compile(r'обратитесь\s+(в|к)?\s*служб[аe]?\s*поддержк[аe]?[^.]*\.?', re.IGNORECASE)
+_EN_SUPPORT_RE = re.compile(r'contact\s+support[^.]*\.?', re.IGNORECASE)
+_EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b')
+
+# Объединённая альтернация для одного прохода по ответу: каждая ветка повторяет
+# соответствующий одиночный паттерн выше, диспетчеризация — по именованным группам.
+# Заголовки здесь НЕ зачищаются: в исходном пайплайне '#' удалялись отдельным
+# первым проходом, и только после этого bold-паттерн видел '****' в начале
+# строки — внутри одного прохода '^' повторно в середине строки не матчится,
+# поэтому дешёвый префиксный проход _HEADER_RE сохранён в format_response
+_CLEANUP_RE = re.compile(
+    r'(?P<bold>^\*{4}\s*(?P<bold_body>.+))'
+    r'|(?P<src>\(\s*(?:источник\w*|sources?)\s*[^)]*\))'
+    r'|(?P<ru>обратитесь\s+(?:в|к)?\s*служб[аe]?\s*поддержк[аe]?[^.]*\.?)'
+    r'|(?P<en>contact\s+support[^.]*\.?)',
+    re.MULTILINE | re.IGNORECASE)
+
+
+def _cleanup_replace(m: re.Match, drop_sources: bool) -> str:
+    if m.group('bold') is not None:
+        # Жирная строка съедает остаток строки, поэтому зачистку источников
+        # и фраз о поддержке прогоняем по её телу отдельно
+        body = m.group('bold_body')
+        if drop_sources:
+            body = _SOURCES_RE.sub('', body)
+        body = _RU_SUPPORT_RE.sub('', body)
+        body = _EN_SUPPORT_RE.sub('', body)
+        return '**' + body + '**'
+    if m.group('src') is not None:
+        return '' if drop_sources else m.group(0)
+    return ''  # ru / en всегда удаляются
+
+
 class ResponseFormatter:
     """
     SINGLE RESPONSIBILITY: Response formatting and cleanup
@@ -29,29 +69,36 @@ class ResponseFormatter:
             # Сразу показываем полный текст без дублирующего системного сообщения
             response = response.replace('[ESCALATE]', '').lstrip()
         
-        # 2. Markdown cleanup (### removal, **** to bold)
-        # Преобразуем **** в жирный Markdown и убираем ### заголовки
-        response = re.sub(r'^#{1,6}\s*', '', response, flags=re.MULTILINE)
-        response = re.sub(r'^\*{4}\s*(.+)', r'**\1**', response, flags=re.MULTILINE)
-
-        # 3. Source removal logic (when user didn't ask for sources)
-        # Дополнительная зачистка: если пользователь не запросил источники, удаляем упоминания "источник"/"sources"
-        user_asked_sources = bool(re.search(r'(источник|sources?)', user_query, re.IGNORECASE))
+        # 2–5. Markdown cleanup, удаление источников (если не запрошены) и фраз
+        # о поддержке — одним проходом по строке вместо шести re.sub
+        # (Email removal остаётся выключенным: self._remove_emails(response))
+        # Дешёвые in-проверки (memchr/memmem в C) отсекают ответы без единого
+        # маркера зачистки — частый случай — не запуская regex-движок вовсе
+        needs_cleanup = '#' in response or '****' in response or '(' in response
+        if not needs_cleanup:
+            lowered = response.lower()
+            needs_cleanup = 'обратитесь' in lowered or 'contact' in lowered
+        if not needs_cleanup:
+            return response
+        # Заголовки снимаем отдельным первым проходом (как в исходном
+        # пайплайне): '# ****жирный' должен стать '**жирный**', а bold-ветка
+        # объединённого прохода видит начало строки только после удаления '#'
+        if '#' in response:
+            response = _HEADER_RE.sub('', response)
+        user_asked_sources = bool(_ASKED_SOURCES_RE.search(user_query))
+        replacer = functools.partial(_cleanup_replace, drop_sources=not user_asked_sources)
+        return _CLEANUP_RE.sub(replacer, response)
         
-        if not user_asked_sources:
-            response = self._remove_sources(response)
-
-        # 4. Email removal logic
-        # Удаляем email
-        # response = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b', '', response)  # 🔧 Убрали автоматическое удаление email
+    @staticmethod
+    def needs_markdown(text: str) -> bool:
+        """True, если в тексте есть Markdown-разметка, требующая parse_mode.
 
-        # 5. Support redirection phrase removal
-        # Удаляем фразы, которые перенаправляют обратно в поддержку (бот сам поддержка)
-        response = re.sub(r'(?i)обратитесь\s+(в|к)?\s*служб[аe]?\s*поддержк[аe]?[^.]*\.?', '', response)
-        response = re.sub(r'(?i)contact\s+support[^.]*\.?', '', response)
+        Системный промпт просит «plain text only», поэтому обычный ответ
+        можно отправлять без парсинга на стороне Telegram — это дешевле и
+        не ловит 400 на невалидных '_'/'*' внутри ссылок.
+        """
+        return '*' in text or '_' in text or '`' in text or '[' in text
 
-        return response
-        
     def _detect_escalation(self, response: str) -> bool:
         """Detect if response contains escalation marker"""
         return '[ESCALATE]' in response
@@ -63,8 +110,8 @@ class ResponseFormatter:
     def _cleanup_markdown(self, response: str) -> str:
         """EXACT COPY: Current regex patterns"""
         # Преобразуем **** в жирный Markdown и убираем ### заголовки
-        response = re.sub(r'^#{1,6}\s*', '', response, flags=re.MULTILINE)
-        response = re.sub(r'^\*{4}\s*(.+)', r'**\1**', response, flags=re.MULTILINE)
+        response = _HEADER_RE.sub('', response)
+        response = _BOLD4_RE.sub(r'**\1**', response)
         return response
         
     def _remove_sources_if_not_requested(self, response: str, user_asked_sources: bool) -> str:
@@ -73,15 +120,22 @@ class ResponseFormatter:
             return self._remove_sources(response)
         return response
         
+    def _remove_emails(self, text: str) -> str:
+        """Удаляет email-адреса из текста"""
+        # Дешёвая проверка '@' (memchr) отсекает >95% текстов без запуска regex
+        if '@' not in text:
+            return text
+        return _EMAIL_RE.sub('', text)
+
     def _remove_sources(self, text: str) -> str:
         """EXACT COPY: Current remove_sources function"""
         # Удаляем шаблоны вида (источник 1, 2) или (sources 3,4)
-        text = re.sub(r'\(\s*(источник\w*|sources?)\s*[^)]*\)', '', text, flags=re.IGNORECASE)
+        text = _SOURCES_RE.sub('', text)
         return text
         
     def _remove_support_redirections(self, response: str) -> str:
         """EXACT COPY: Current support phrase removal"""
         # Удаляем фразы, которые перенаправляют обратно в поддержку (бот сам поддержка)
-        response = re.sub(r'(?i)обратитесь\s+(в|к)?\s*служб[аe]?\s*поддержк[аe]?[^.]*\.?', '', response)
-        response = re.sub(r'(?i)contact\s+support[^.]*\.?', '', response)
+        response = _RU_SUPPORT_RE.sub('', response)
+        response = _EN_SUPPORT_RE.sub('', response)
         return response 
\ No newline at end of file
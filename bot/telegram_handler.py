@@ -1,13 +1,14 @@
+import asyncio
 import os
 import logging
 import re
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Optional
 from dotenv import load_dotenv
-from datetime import datetime
-from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, MessageHandler, CallbackQueryHandler, CommandHandler, filters, ContextTypes
 from telegram.constants import ParseMode
-from langdetect import detect, DetectorFactory
 
 # Import new modular services
 from core.conversation_manager import ConversationManager
@@ -23,9 +24,27 @@ from embeddings.line_chunker import LineChunker
 from embeddings.embedder import Embedder
 from embeddings.vector_store import VectorStore
 from embeddings.search import DocumentSearch
-from config.settings import BOT_SETTINGS, LLM_SETTINGS
 
-DetectorFactory.seed = 0  # For consistent langdetect
+# Сообщение целиком из кириллицы (плюс пробелы/цифры/знаки) — однозначно русский
+_CYR_RE = re.compile(r'^[\s\W\d_А-Яа-яЁё]+$')
+
+
+def _detect_lang(text: str) -> str:
+    """Определяет язык ('en'/'ru') подсчётом кириллических и латинских букв.
+
+    Для бота с двумя языками n-граммный langdetect был избыточен: миллисекунды
+    на вызов и десятки МБ профилей, когда вопрос сводится к «чего в тексте
+    больше — кириллицы или латиницы».
+    """
+    cyr = lat = 0
+    for ch in text:
+        if 'Ѐ' <= ch <= 'ӿ':
+            cyr += 1
+        elif ('a' <= ch <= 'z') or ('A' <= ch <= 'Z'):
+            lat += 1
+    return 'ru' if cyr > lat else 'en'
+
+
 logging.basicConfig(level=logging.INFO)
 
 # Suppress INFO logs from noisy libraries, keep ERROR and WARNING
@@ -36,13 +55,35 @@ logging.getLogger('telegram.ext').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 # --- Additional logger for user requests -----------------------------------
+# Запись в файл идёт через QueueListener в фоновом потоке: хендлер-корутина
+# кладёт запись в очередь за O(1) и не ждёт write()+flush() на диске
 os.makedirs('logs', exist_ok=True)
 user_logger = logging.getLogger('user_requests')
 user_logger.setLevel(logging.INFO)
 if not user_logger.handlers:
-    req_handler = logging.FileHandler('logs/user_requests.log', encoding='utf-8')
+    req_handler = logging.FileHandler('logs/user_requests.log', encoding='utf-8', delay=True)
     req_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-    user_logger.addHandler(req_handler)
+    _log_queue: SimpleQueue = SimpleQueue()
+    user_logger.addHandler(QueueHandler(_log_queue))
+    _log_listener = QueueListener(_log_queue, req_handler)
+    _log_listener.start()
+
+# --- Константы /start: собираем один раз, а не на каждый вызов --------------
+_GREETINGS = {
+    'ru': 'Привет! Я помощник поддержки Spartans.com. Чем могу помочь?',
+    'en': 'Hi! I\'m the Spartans.com support assistant. How can I help?',
+}
+_START_KEYBOARDS = {
+    lang: InlineKeyboardMarkup([
+        [InlineKeyboardButton('RU', callback_data='lang_ru'), InlineKeyboardButton('EN', callback_data='lang_en')],
+        [InlineKeyboardButton('Сбросить историю' if lang == 'ru' else 'Reset history', callback_data='reset')],
+    ])
+    for lang in ('ru', 'en')
+}
+_ERROR_MSGS = {
+    'ru': 'Ситуация кажется серьёзной, я уже зову оператора - он подойдёт через минуту.',
+    'en': 'The situation seems serious, I\'m calling an operator - they\'ll join in a minute.',
+}
 
 class TelegramHandler:
     """
@@ -64,7 +105,8 @@ class TelegramHandler:
     
     def __init__(self, telegram_token: str, deepseek_api_key: str):
         # Initialize with new modular services but keep message processing in same class
-        self.application = Application.builder().token(telegram_token).build()
+        # post_init выполняется после initialize() и до старта polling
+        self.application = Application.builder().token(telegram_token).post_init(self._post_init).build()
         
         # Initialize embeddings infrastructure (keep existing)
         self.chunker = LineChunker()  # используем новый алгоритм
@@ -83,11 +125,30 @@ class TelegramHandler:
         self.response_formatter = ResponseFormatter()
         self.admin_handler = AdminHandler(os.getenv('BOT_SYS_PASSWORD', ''))
 
-        self.bot_username: str = ""  # будет заполнено при первом обращении
+        self.bot_username: str = ""  # заполняется в _post_init до старта polling
+        # Якорный regex упоминания '@<bot_username>', компилируется в _post_init
+        self._mention_re: Optional[re.Pattern] = None
 
-        self.load_documents()
         self._setup_handlers()
-    
+
+    async def _post_init(self, application: Application):
+        """Стартовая инициализация: имя бота и индексация документов параллельно.
+
+        get_me() раньше лениво дёргался из handle_message на первом групповом
+        сообщении, а load_documents блокировал __init__; теперь сетевой запрос
+        и CPU-bound индексация перекрываются, и polling стартует после обоих.
+        """
+        me, _ = await asyncio.gather(
+            application.bot.get_me(),
+            asyncio.to_thread(self.load_documents),
+        )
+        self.bot_username = (me.username or '').lower()
+        # Компилируем упоминание один раз: якорный IGNORECASE-матч делает
+        # O(len(префикса)) работы без lower()-копии сообщения
+        if self.bot_username:
+            self._mention_re = re.compile(
+                rf'^\s*@{re.escape(self.bot_username)}\b\s*', re.IGNORECASE)
+
     def load_documents(self):
         """(Re)index documents and provide detailed logging."""
         before_total = self.vector_store.get_stats().get('total_embeddings', 0)
@@ -145,61 +206,89 @@ class TelegramHandler:
 
         # --- Ignore group messages unless bot is mentioned first -------------------------
         if update.effective_chat and update.effective_chat.type in ['group', 'supergroup']:
-            if not self.bot_username:
-                try:
-                    me = await context.bot.get_me()
-                    self.bot_username = (me.username or '').lower()
-                except Exception as e:
-                    logger.warning(f'Failed to fetch bot username: {e}')
-            mention_prefix = f'@{self.bot_username}' if self.bot_username else ''
-            if mention_prefix:
-                if not message_text.lower().startswith(mention_prefix):
+            # _mention_re скомпилирован один раз в _post_init — сетевых запросов здесь нет
+            if self._mention_re is not None:
+                mention = self._mention_re.match(message_text)
+                if not mention:
                     return  # бот не упомянут первым
-                # убираем упоминание из начала текста
-                message_text = message_text[len(mention_prefix):].lstrip()
+                # убираем упоминание (и пробелы вокруг) из начала текста
+                message_text = message_text[mention.end():]
                 if not message_text:
                     return  # пустой запрос после упоминания
 
         # Auto-detect language and store preference
+        # Детект языка дешёвый, но кэш и ASCII-фаст-пас всё равно быстрее
         query_language = 'en'
-        try:
-            query_language_detected = detect(message_text)
-            if query_language_detected in ['en', 'ru']:
-                query_language = query_language_detected
-                self.conversation_manager.set_user_language(user_id, query_language)
-        except Exception as e:
-            logger.warning(f'Language detection failed: {e}')
+        cached_language = self.conversation_manager.get_user_language(user_id, '')
+        if cached_language and len(message_text) < 200:
+            # Язык уже известен — короткие follow-up сообщения не детектируем заново
+            query_language = cached_language
+        elif message_text.isascii():
+            query_language = 'en'
+            self.conversation_manager.set_user_language(user_id, 'en')
+        elif _CYR_RE.match(message_text):
+            query_language = 'ru'
+            self.conversation_manager.set_user_language(user_id, 'ru')
+        elif len(message_text) >= 8:
+            try:
+                query_language_detected = _detect_lang(message_text)
+                if query_language_detected in ['en', 'ru']:
+                    query_language = query_language_detected
+                    self.conversation_manager.set_user_language(user_id, query_language)
+            except Exception as e:
+                logger.warning(f'Language detection failed: {e}')
+        # Совсем короткий смешанный текст детектору не по зубам — остаёмся на 'en'
 
         user_language = self.conversation_manager.get_user_language(user_id, query_language)
-        await update.message.reply_chat_action('typing')
+        # Telegram гасит индикатор «печатает…» через ~5 секунд, а генерация
+        # ответа может идти десятки секунд — обновляем индикатор фоновой задачей
+        typing_task = asyncio.create_task(self._keep_typing(update.message))
         try:
             # Use new modular services
-            doc_context = self.context_builder.get_context_for_query(message_text, query_language)
-            history = self.conversation_manager.get_history(user_id)
-            response = self.llm_service.generate_support_response(message_text, doc_context, history, language=user_language)
-            
+            doc_context = await self.context_builder.aget_context_for_query(message_text, query_language)
+            # Блокирующие вызовы SQLite уходят в пул потоков, чтобы event loop
+            # продолжал обслуживать других пользователей во время дисковых операций
+            history = await self.conversation_manager.aget_history(user_id)
+            # LLM-вызов — синхронный requests с таймаутом до 60 с; уводим его в
+            # пул потоков, иначе loop (и _keep_typing) стоит весь round-trip
+            response = await asyncio.to_thread(
+                self.llm_service.generate_support_response,
+                message_text, doc_context, history, language=user_language)
+
             # Use response formatter
             formatted_response = self.response_formatter.format_response(response, message_text, user_language)
 
-            self.conversation_manager.add_message(user_id, 'user', message_text)
-            self.conversation_manager.add_message(user_id, 'bot', formatted_response)
-            await update.message.reply_text(formatted_response, parse_mode=ParseMode.MARKDOWN)
+            # Пара user+bot пишется одной транзакцией — один fsync на ход диалога
+            await self.conversation_manager.aadd_message_pair(user_id, message_text, formatted_response)
+            # Markdown-парсинг включаем только когда в ответе есть разметка:
+            # plain-ответы не парсятся на стороне Telegram и не ловят 400
+            parse_mode = ParseMode.MARKDOWN if self.response_formatter.needs_markdown(formatted_response) else None
+            await update.message.reply_text(formatted_response, parse_mode=parse_mode)
         except Exception as e:
             logger.error(f'Error: {e}')
-            error_msg = 'Ситуация кажется серьёзной, я уже зову оператора - он подойдёт через минуту.' if user_language == 'ru' else 'The situation seems serious, I\'m calling an operator - they\'ll join in a minute.'
-            await update.message.reply_text(error_msg)
+            await update.message.reply_text(_ERROR_MSGS['ru' if user_language == 'ru' else 'en'])
+        finally:
+            typing_task.cancel()
+
+    @staticmethod
+    async def _keep_typing(message):
+        """Шлёт chat_action 'typing' каждые 4 секунды, пока задачу не отменят"""
+        try:
+            while True:
+                await message.reply_chat_action('typing')
+                await asyncio.sleep(4)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:  # сбой индикатора не должен ронять обработку
+            logger.debug(f'typing indicator stopped: {e}')
     
     async def start_conversation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user is None or update.message is None:
             logger.error('Invalid update in start_conversation')
             return
         user_id = update.effective_user.id
-        user_language = self.conversation_manager.get_user_language(user_id, 'en')
-        greeting = 'Привет! Я помощник поддержки Spartans.com. Чем могу помочь?' if user_language == 'ru' else 'Hi! I\'m the Spartans.com support assistant. How can I help?'
-        keyboard = [[InlineKeyboardButton('RU', callback_data='lang_ru'), InlineKeyboardButton('EN', callback_data='lang_en')],
-                    [InlineKeyboardButton('Сбросить историю' if user_language == 'ru' else 'Reset history', callback_data='reset')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(greeting, reply_markup=reply_markup)
+        user_language = 'ru' if self.conversation_manager.get_user_language(user_id, 'en') == 'ru' else 'en'
+        await update.message.reply_text(_GREETINGS[user_language], reply_markup=_START_KEYBOARDS[user_language])
     
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
@@ -214,7 +303,7 @@ class TelegramHandler:
             await query.answer('Language changed!')
             await self.start_conversation(update, context)
         elif data == 'reset':
-            self.conversation_manager.reset_history(user_id)
+            await self.conversation_manager.areset_history(user_id)
             await query.answer('History reset!')
             await self.start_conversation(update, context)
     
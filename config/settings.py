@@ -27,7 +27,8 @@ EMBEDDING_SETTINGS = {
 
 # Настройки ChromaDB
 CHROMADB_SETTINGS = {
-    'persist_directory': 'chroma_db',  'collection_name': 'spartans_docs'
+    'persist_directory': 'chroma_db',  'collection_name': 'spartans_docs',
+    'upsert_batch_size': 128,  # Векторов на один upsert (оптимум Chroma ~50-250)
 }
 
 # Настройки поиска
@@ -36,7 +37,8 @@ SEARCH_SETTINGS = {
     'max_top_k': 30,     # Максимальное количество результатов
     'similarity_threshold': 0.3,  # Минимальный порог сходства
     'enable_fuzzy_search': True,
-    'preprocess_type': 'simple'  # or 'deepseek'
+    'preprocess_type': 'simple',  # or 'deepseek'
+    'semantic_cache_threshold': 0.97,  # Косинусный порог семантического кэша поиска
 }
 
 # Настройки LLM
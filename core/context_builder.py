@@ -1,5 +1,12 @@
+import asyncio
+import os
+
 from embeddings.search import DocumentSearch
 
+# Ограничитель параллельных поисков: эмбеддинг+ANN — CPU-bound, и безграничная
+# параллельность из пула потоков даёт только контентию, а не ускорение
+_SEARCH_SEM = asyncio.Semaphore(os.cpu_count() or 4)
+
 class ContextBuilder:
     """
     SINGLE RESPONSIBILITY: Context search and building
@@ -18,13 +25,17 @@ class ContextBuilder:
         
     def get_context_for_query(self, query: str, language: str) -> str:
         """
-        EXACT COPY: Current logic from main.py handle_message
-        processed_query = self.search.preprocess_query(message_text, query_language)
-        contexts = self.search.get_multilingual_context(processed_query, top_k=25)
-        doc_context_raw = contexts.get(query_language, '') or next(iter(contexts.values()), '')
-        return doc_context_raw  # No email removal at this stage
+        Ищем только на языке запроса — один эмбеддинг и один ANN-запрос;
+        второй язык пробуем лишь когда первый ничего не нашёл
         """
         processed_query = self.search.preprocess_query(query, language)
-        contexts = self.search.get_multilingual_context(processed_query, top_k=25, language=language)  # Pass language to limit search
-        doc_context_raw = contexts.get(language, '') or next(iter(contexts.values()), '')
-        return doc_context_raw  # No email removal at this stage 
\ No newline at end of file
+        doc_context_raw = self.search.get_context(processed_query, language, top_k=25)
+        if not doc_context_raw:
+            fallback_language = 'en' if language == 'ru' else 'ru'
+            doc_context_raw = self.search.get_context(processed_query, fallback_language, top_k=25)
+        return doc_context_raw  # No email removal at this stage
+
+    async def aget_context_for_query(self, query: str, language: str) -> str:
+        """Асинхронная обёртка: поиск уходит в пул потоков, конкурентность ограничена"""
+        async with _SEARCH_SEM:
+            return await asyncio.to_thread(self.get_context_for_query, query, language)
\ No newline at end of file
@@ -1,6 +1,39 @@
+import asyncio
+import atexit
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
 from typing import List, Dict
 
+
+class _LRUDict(OrderedDict):
+    """Словарь с ограничением размера: при переполнении вытесняет самый давний ключ.
+
+    Нужен, чтобы память долгоживущего бота не росла линейно с числом
+    уникальных пользователей; горячие пользователи остаются в кэше.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.move_to_end(key)
+        super().__setitem__(key, value)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            self.move_to_end(key)  # обращение освежает запись
+        except KeyError:
+            return default
+        return super().__getitem__(key)
+
+
 class ConversationManager:
     """
     SINGLE RESPONSIBILITY: Conversation history and user preferences
@@ -16,27 +49,77 @@ class ConversationManager:
     """
     
     def __init__(self, db_path: str = 'conversation_history.db'):
-        # EXACT COPY: Current HistoryManager.__init__
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
+        self._lock = threading.Lock()
+        # Для файловой БД — соединение на поток (WAL допускает параллельных
+        # читателей, busy_timeout разруливает редкие одновременные записи),
+        # лок не нужен. ':memory:' живёт внутри одного соединения, поэтому
+        # для неё остаётся общий conn, сериализованный через _lock.
+        self._local = threading.local()
+        self._all_conns: List[sqlite3.Connection] = []
+        self._shared_conn = self._connect() if db_path == ':memory:' else None
         self.init_db()
-        
+
         # NEW: Extract from main.py self.user_languages management
-        self.user_languages = {}  # {user_id: 'en' or 'ru'}
-    
+        # LRU-ограничение: язык хранится для ~10k последних активных пользователей
+        self.user_languages = _LRUDict(maxsize=10000)  # {user_id: 'en' or 'ru'}
+
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if self.db_path != ':memory:':
+            # WAL: commit — это append в лог вместо fsync полного rollback-журнала,
+            # читатели не блокируют писателя; synchronous=NORMAL безопасен в WAL
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-8000')
+            conn.execute('PRAGMA mmap_size=268435456')
+            conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока (или общее для ':memory:')"""
+        if self._shared_conn is not None:
+            return self._shared_conn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._all_conns.append(conn)
+        return conn
+
     def init_db(self):
-        # EXACT COPY: Current HistoryManager.init_db
-        cursor = self.conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS messages (
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
             role TEXT,
             content TEXT
         )''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON messages (user_id)')
-        self.conn.commit()
+        # Миграция: целочисленный unix-epoch столбец вместо сравнения ISO-строк.
+        # Существующие строки бэкфилим из текстового timestamp один раз.
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(messages)')}
+        if 'ts_unix' not in columns:
+            conn.execute('ALTER TABLE messages ADD COLUMN ts_unix INTEGER')
+            conn.execute('''UPDATE messages
+                SET ts_unix = CAST(strftime('%s', timestamp) AS INTEGER)
+                WHERE ts_unix IS NULL''')
+        # Составной индекс покрывает и фильтр по user_id, и ORDER BY ... LIMIT
+        # в get_history/обрезке; одиночный idx_user_id им полностью перекрыт
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_ts ON messages (user_id, id DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_ts_unix ON messages (user_id, ts_unix)')
+        conn.execute('DROP INDEX IF EXISTS idx_user_id')
+        conn.commit()
     
+    def _guard(self):
+        """Лок нужен только общему ':memory:'-соединению; у файловой БД
+        каждый поток работает со своим conn и сериализацию даёт сам SQLite"""
+        return self._lock if self._shared_conn is not None else nullcontext()
+
     def set_user_language(self, user_id: int, language: str):
         """NEW: Extract from main.py self.user_languages management"""
         self.user_languages[user_id] = language
@@ -46,47 +129,86 @@ class ConversationManager:
         return self.user_languages.get(user_id, default)
         
     def add_message(self, user_id: int, role: str, content: str):
-        # EXACT COPY: Current HistoryManager.add_message
-        cursor = self.conn.cursor()
-        cursor.execute('INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)', (user_id, role, content))
-        self.conn.commit()
-        # Limit to 20: delete oldest if over
-        cursor.execute('SELECT COUNT(*) FROM messages WHERE user_id = ?', (user_id,))
-        count = cursor.fetchone()[0]
-        if count > 20:
-            cursor.execute('''DELETE FROM messages WHERE id IN (
-                SELECT id FROM messages WHERE user_id = ? ORDER BY timestamp ASC LIMIT ?
-            )''', (user_id, count - 20))
-            self.conn.commit()
+        # INSERT и обрезающий DELETE в одной транзакции: один fsync вместо двух
+        # и без отдельного COUNT(*) — подзапрос сам находит границу 20 сообщений
+        # по первичному ключу (id монотонен, B-дерево PK используется напрямую)
+        conn = self._conn()
+        with self._guard(), conn:
+            conn.execute('INSERT INTO messages (user_id, role, content, ts_unix) VALUES (?, ?, ?, ?)',
+                         (user_id, role, content, int(time.time())))
+            conn.execute('''DELETE FROM messages WHERE user_id = ? AND id <= (
+                SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET 20
+            )''', (user_id, user_id))
     
+    def add_message_pair(self, user_id: int, user_text: str, bot_text: str):
+        """Записывает реплику пользователя и ответ бота одной транзакцией.
+
+        Каждый ход диалога — это ровно пара сообщений; executemany с одной
+        обрезкой и одним commit вдвое сокращает число транзакций на ход.
+        """
+        conn = self._conn()
+        now = int(time.time())
+        with self._guard(), conn:
+            conn.executemany(
+                'INSERT INTO messages (user_id, role, content, ts_unix) VALUES (?, ?, ?, ?)',
+                [(user_id, 'user', user_text, now), (user_id, 'bot', bot_text, now)])
+            conn.execute('''DELETE FROM messages WHERE user_id = ? AND id <= (
+                SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET 20
+            )''', (user_id, user_id))
+
     def get_history(self, user_id: int) -> List[Dict[str, str]]:
-        """EXACT COPY: Current HistoryManager.get_history (1-hour window + 20 limit)"""
-        from datetime import datetime, timedelta  # локальный импорт, чтобы избежать циклов
+        """История за последний час, не более 20 сообщений (старое → новое)"""
+        # Целочисленное сравнение по ts_unix вместо посимвольного сравнения
+        # ISO-строк; порог — просто «час назад» в unix-секундах
+        threshold_time = int(time.time()) - 3600
 
-        # Вычисляем пороговое время – ровно час назад от текущего момента
-        threshold_time = (datetime.utcnow() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+        with self._guard():
+            # Разворот в хронологический порядок делает внешний ORDER BY id ASC —
+            # без fetchall + reversed() и промежуточного списка на питоне
+            cursor = self._conn().execute('''
+                SELECT role, content FROM (
+                    SELECT role, content, id FROM messages
+                    WHERE user_id = ? AND ts_unix >= ?
+                    ORDER BY id DESC
+                    LIMIT 20
+                ) ORDER BY id ASC
+            ''', (user_id, threshold_time))
+            return [{'role': role, 'content': content} for role, content in cursor]
+    
+    def reset_history(self, user_id: int):
+        conn = self._conn()
+        with self._guard(), conn:
+            conn.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
 
-        cursor = self.conn.cursor()
+    # --- Асинхронные обёртки ------------------------------------------------
+    # SQLite-вызовы блокируют поток на время дисковой операции; из корутин их
+    # следует вызывать через эти обёртки, чтобы не вставал весь event loop
 
-        # Получаем не более 20 последних сообщений, отправленных за последний час
-        cursor.execute('''
-            SELECT role, content FROM messages
-            WHERE user_id = ? AND timestamp >= ?
-            ORDER BY timestamp DESC, id DESC
-            LIMIT 20
-        ''', (user_id, threshold_time))
+    async def aget_history(self, user_id: int) -> List[Dict[str, str]]:
+        return await asyncio.to_thread(self.get_history, user_id)
 
-        rows = cursor.fetchall()
+    async def aadd_message(self, user_id: int, role: str, content: str):
+        await asyncio.to_thread(self.add_message, user_id, role, content)
 
-        # Переворачиваем, чтобы вернуть в хронологическом (старое → новое) порядке
-        return [{'role': row[0], 'content': row[1]} for row in reversed(rows)]
-    
-    def reset_history(self, user_id: int):
-        # EXACT COPY: Current HistoryManager.reset_history
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
-        self.conn.commit()
+    async def aadd_message_pair(self, user_id: int, user_text: str, bot_text: str):
+        await asyncio.to_thread(self.add_message_pair, user_id, user_text, bot_text)
+
+    async def areset_history(self, user_id: int):
+        await asyncio.to_thread(self.reset_history, user_id)
     
-    def __del__(self):
-        # EXACT COPY: Current HistoryManager.__del__
-        self.conn.close() 
\ No newline at end of file
+    def close(self):
+        """Закрывает все соединения; регистрируется в atexit вместо __del__.
+
+        __del__ ненадёжен: порядок GC при завершении интерпретатора не
+        определён, и исключение из него молча проглатывается.
+        """
+        with self._lock:
+            conns, self._all_conns = self._all_conns, []
+        if self._shared_conn is not None:
+            conns.append(self._shared_conn)
+            self._shared_conn = None
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
\ No newline at end of file
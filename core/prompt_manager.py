@@ -1,6 +1,10 @@
 import os
+import re
 from pathlib import Path
 
+# Разделитель для предразбиения шаблона на литеральные куски вокруг маркеров
+_MARKER_RE = re.compile(r'(\{promotions\}|\{context\})')
+
 class PromptManager:
     """
     SINGLE RESPONSIBILITY: System prompt construction
@@ -93,40 +97,53 @@ Do not use emojis."""
     def __init__(self):
         self._cached_prompt = None
         self._prompt_file_mtime = None
-        
+        # Шаблон и акции держим в памяти; stat() обоих файлов на каждый вызов
+        # дёшев, перечитываем с диска только при смене mtime
+        self._template_parts = None
+        self._promotions_cache = ''
+        self._promotions_mtime = None
+
     def get_system_prompt(self, context: str) -> str:
         """
         Load from prompts/system_prompt.txt with caching
-        EXACT COPY: Current _load_system_prompt logic
         Template substitution with {context} and {promotions}
         """
-        # Load promotions from data files
         promotions = self._load_promotions()
-        
-        # Load system prompt template
-        try:
-            with open('prompts/system_prompt.txt', 'r', encoding='utf-8') as file:
-                template = file.read()
-            if not template.strip():
-                raise ValueError('Prompt file empty')
-        except Exception:
-            # Fall back to internal default template if file missing or invalid
-            template = self._DEFAULT_PROMPT_TEMPLATE
-
-        return (
-            template
-            .replace("{promotions}", promotions)
-            .replace("{context}", context)
-        )
-        
+        parts = self._get_template_parts()
+
+        # Подстановка через join по предразбитым кускам вместо двух
+        # O(N)-проходов str.replace по всему шаблону
+        subst = {'{promotions}': promotions, '{context}': context}
+        return ''.join(subst.get(part, part) for part in parts)
+
+    def _get_template_parts(self) -> list:
+        """Возвращает шаблон, предразбитый вокруг маркеров; кэш по mtime файла"""
+        changed = self._check_prompt_file_changed()  # всегда освежает mtime
+        if self._template_parts is None or changed:
+            try:
+                with open('prompts/system_prompt.txt', 'r', encoding='utf-8') as file:
+                    template = file.read()
+                if not template.strip():
+                    raise ValueError('Prompt file empty')
+            except Exception:
+                # Fall back to internal default template if file missing or invalid
+                template = self._DEFAULT_PROMPT_TEMPLATE
+            self._template_parts = _MARKER_RE.split(template)
+        return self._template_parts
+
     def _load_promotions(self) -> str:
-        """EXACT COPY: Load promotions from data files"""
-        promotions_en = ''
-        if os.path.exists('data/en/promotions.txt'):
+        """Load promotions from data files (кэш инвалидируется по mtime)"""
+        try:
+            mtime = os.stat('data/en/promotions.txt').st_mtime
+        except OSError:
+            self._promotions_mtime = None
+            self._promotions_cache = ''
+            return ''
+        if mtime != self._promotions_mtime:
             with open('data/en/promotions.txt', 'r', encoding='utf-8') as f:
-                promotions_en = f.read()
-        promotions = promotions_en
-        return promotions
+                self._promotions_cache = f.read()
+            self._promotions_mtime = mtime
+        return self._promotions_cache
         
     def _check_prompt_file_changed(self) -> bool:
         """File modification time checking for cache invalidation"""
@@ -1,4 +1,5 @@
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 import json
 import os
@@ -8,6 +9,12 @@ from config.settings import OPENAI_API_KEY, EMBEDDING_SETTINGS
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Лимиты embeddings-запроса OpenAI: не более 2048 входов и ~300k токенов;
+# держим запас по токенам, чтобы не ловить 400 на жирных чанках
+_MAX_BATCH_INPUTS = 2048
+_MAX_BATCH_TOKENS = 250_000
+_MAX_PARALLEL_REQUESTS = 8
+
 class Embedder:
     """Класс для создания эмбеддингов текста"""
     
@@ -15,27 +22,64 @@ class Embedder:
         self.model_name = EMBEDDING_SETTINGS['model_name']
         self.embedding_dim = EMBEDDING_SETTINGS['dimensions']
         
-    def _create_embeddings(self, inputs):
-        # If no key is provided, allow offline tests by returning zero vectors
-        if not OPENAI_API_KEY:
-            return [[0.0] * self.embedding_dim for _ in inputs]
+    def _pack_batches(self, inputs, batch_size: int) -> List[list]:
+        """Жадно пакует входы в батчи с учётом токенов и лимитов API"""
+        try:
+            import tiktoken
+            enc = tiktoken.get_encoding('cl100k_base')
+            counts = [len(t) for t in enc.encode_ordinary_batch(list(inputs))]
+        except Exception:
+            # tiktoken недоступен — грубая оценка ~3 символа на токен
+            counts = [len(text) // 3 + 1 for text in inputs]
 
+        max_inputs = min(batch_size, _MAX_BATCH_INPUTS)
+        batches = []
+        batch, batch_tokens = [], 0
+        for text, n_tokens in zip(inputs, counts):
+            if batch and (batch_tokens + n_tokens > _MAX_BATCH_TOKENS or len(batch) == max_inputs):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += n_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(self, batch):
         try:
-            resp = client.embeddings.create(model=self.model_name, input=inputs)
-            return [d.embedding for d in resp.data]
+            resp = client.embeddings.create(model=self.model_name, input=batch)
         except openai.NotFoundError:
             # Model not available for the account – fallback to ada-002
             fallback_model = "text-embedding-ada-002"
-            resp = client.embeddings.create(model=fallback_model, input=inputs)
-            return [d.embedding for d in resp.data]
+            resp = client.embeddings.create(model=fallback_model, input=batch)
+        return [d.embedding for d in resp.data]
+
+    def _create_embeddings(self, inputs, batch_size: int = 256):
+        # If no key is provided, allow offline tests by returning zero vectors
+        if not OPENAI_API_KEY:
+            return [[0.0] * self.embedding_dim for _ in inputs]
+
+        # Пакуем входы по токенам (а не по числу строк): один гигантский
+        # запрос упирается в лимиты API, а по одному тексту — это round-trip
+        # на каждый чанк. Несколько батчей уходят параллельно — ингест
+        # ограничен сетевой задержкой, а не CPU.
+        batches = self._pack_batches(inputs, batch_size)
+        if len(batches) <= 1:
+            return self._embed_batch(batches[0]) if batches else []
+        with ThreadPoolExecutor(max_workers=min(_MAX_PARALLEL_REQUESTS, len(batches))) as pool:
+            results = pool.map(self._embed_batch, batches)
+        # pool.map сохраняет порядок батчей, порядок входов не меняется
+        return [emb for batch_result in results for emb in batch_result]
 
     def embed_text(self, text: str) -> np.ndarray:
         """Создает эмбеддинг для одного текста"""
-        return np.array(self._create_embeddings([text])[0])
-    
-    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        # float32 вместо дефолтного float64: вдвое меньше памяти и трафика DRAM
+        # в dot-product вычислениях, точности для косинусного сходства достаточно
+        return np.asarray(self._create_embeddings([text])[0], dtype=np.float32)
+
+    def embed_texts(self, texts: List[str], batch_size: int = 256) -> np.ndarray:
         """Создает эмбеддинги для списка текстов"""
-        return np.array(self._create_embeddings(texts))
+        return np.asarray(self._create_embeddings(texts, batch_size=batch_size), dtype=np.float32)
     
     def embed_chunks(self, chunks: List[Any]) -> List[Dict[str, Any]]:
         """Создает эмбеддинги для списка чанков"""
@@ -65,14 +109,28 @@ class Embedder:
         return results
     
     def save_embeddings(self, embeddings: List[Dict[str, Any]], file_path: str):
-        """Сохраняет эмбеддинги в JSON файл"""
+        """Сохраняет эмбеддинги: векторы — fp16 в .npz, метаданные — JSON.
+
+        JSON-дамп вектора — ~20 символов на float против 2 байт в fp16;
+        для косинусного ранжирования потери точности fp16 незначимы.
+        """
+        vectors = np.asarray([e['embedding'] for e in embeddings], dtype=np.float16)
+        metadata = [{k: v for k, v in e.items() if k != 'embedding'} for e in embeddings]
+        np.savez_compressed(file_path + '.npz', emb=vectors)
         with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(embeddings, f, ensure_ascii=False, indent=2)
-    
+            json.dump(metadata, f, ensure_ascii=False)
+
     def load_embeddings(self, file_path: str) -> List[Dict[str, Any]]:
-        """Загружает эмбеддинги из JSON файла"""
+        """Загружает эмбеддинги (новый .npz-формат или старый чистый JSON)"""
         with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            records = json.load(f)
+        if records and 'embedding' in records[0]:
+            # Старый формат: векторы лежали прямо в JSON
+            return records
+        vectors = np.load(file_path + '.npz')['emb']
+        for record, vector in zip(records, vectors):
+            record['embedding'] = np.asarray(vector, dtype=np.float32)
+        return records
     
     def get_embedding_dimension(self) -> int:
         """Возвращает размерность эмбеддингов"""
@@ -84,8 +142,10 @@ class Embedder:
     
     def batch_similarity(self, query_embedding: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
         """Вычисляет сходство между запросом и списком эмбеддингов"""
-        # Нормализуем эмбеддинги для косинусного сходства
-        query_norm = query_embedding / np.linalg.norm(query_embedding)
-        embeddings_norm = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-        
-        return np.dot(embeddings_norm, query_norm)
+        # Один BLAS-дот по исходной матрице + нормы по строкам: не
+        # материализуем нормированную N×D-копию корпуса на каждый вызов,
+        # деление идёт по N-вектору скоров
+        scores = embeddings @ query_embedding
+        norms = np.linalg.norm(embeddings, axis=1)
+        norms *= np.linalg.norm(query_embedding)
+        return scores / norms
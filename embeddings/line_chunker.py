@@ -9,12 +9,16 @@
 from __future__ import annotations
 
 import os
+from pathlib import Path
 from typing import List, Dict, Any
 
+import numpy as np
 import tiktoken
 
+from concurrent.futures import ProcessPoolExecutor
+
 from config.settings import CHUNK_SETTINGS
-from embeddings.chunker import Chunk  # переиспользуем общий dataclass
+from embeddings.chunker import Chunk, _process_file  # переиспользуем общий dataclass и воркер пула
 
 
 class LineChunker:
@@ -35,26 +39,36 @@ class LineChunker:
     # ---------------------------------------------------------------------
     def process_document(self, file_path: str, language: str = "en") -> List[Chunk]:
         """Читает файл и формирует список чанков (по строкам)."""
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+        # Один bulk-read + один decode + splitlines вместо построчного
+        # инкрементального декодирования io-слоя в readlines()
+        lines = Path(file_path).read_bytes().decode("utf-8").splitlines()
 
         filename = os.path.basename(file_path)
         doc_id = os.path.splitext(filename)[0]
 
+        # Убираем лишние пробелы / переводы строк, пустые строки пропускаем
+        numbered_lines = [(number, line) for number, line in
+                          ((n, raw.strip()) for n, raw in enumerate(lines, 1)) if line]
+        if not numbered_lines:
+            return []
+
+        # Один батчевый вызов вместо encode() на строку: Rust-ядро tiktoken
+        # параллелит батч, а FFI-переход оплачивается один раз на файл
+        token_lists = self.tokenizer.encode_ordinary_batch(
+            [line for _, line in numbered_lines],
+            num_threads=os.cpu_count() or 1)
+        segments_per_line = [self._split_tokens(tokens) for tokens in token_lists]
+        decoded = self.tokenizer.decode_batch(
+            [seg for segments in segments_per_line for seg in segments])
+
         chunks: List[Chunk] = []
-        for line_number, raw_line in enumerate(lines, 1):
-            # Убираем лишние пробелы / переводы строк
-            line = raw_line.strip()
-            if not line:
-                continue  # пропускаем пустые строки
-
-            # Токенизируем строку и режем при необходимости
-            tokens = self.tokenizer.encode(line)
-            token_segments = self._split_tokens(tokens)
+        pos = 0
+        for (line_number, _), token_segments in zip(numbered_lines, segments_per_line):
             total_segments = len(token_segments)
 
-            for seg_index, seg_tokens in enumerate(token_segments):
-                content = self.tokenizer.decode(seg_tokens)
+            for seg_index in range(total_segments):
+                content = decoded[pos]
+                pos += 1
                 chunk_id = f"{doc_id}_L{line_number}_S{seg_index}"
                 chunk_meta = {
                     "line_number": line_number,
@@ -78,20 +92,31 @@ class LineChunker:
 
     def process_all_documents(self, data_dir: str) -> List[Chunk]:
         """Обрабатывает все языковые поддиректории аналогично старому Chunker."""
-        all_chunks: List[Chunk] = []
+        tasks: List[tuple] = []
         for lang in ["en", "ru"]:
             lang_dir = os.path.join(data_dir, lang)
             if not os.path.isdir(lang_dir):
                 continue
-            for filename in os.listdir(lang_dir):
-                if not filename.endswith(".txt"):
-                    continue
-                if "promotions" in filename:
-                    # Эти файлы не индексируем — логика сохранена из DocumentChunker
-                    continue
-                file_path = os.path.join(lang_dir, filename)
-                all_chunks.extend(self.process_document(file_path, lang))
-        return all_chunks
+            # scandir отдаёт DirEntry с готовым path — без join и лишних stat
+            with os.scandir(lang_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".txt"):
+                        continue
+                    if "promotions" in entry.name:
+                        # Эти файлы не индексируем — логика сохранена из DocumentChunker
+                        continue
+                    tasks.append((entry.path, lang))
+
+        # Как и в DocumentChunker: файлы чанкаются параллельно по процессам
+        if len(tasks) <= 1:
+            return [chunk for file_path, lang in tasks
+                    for chunk in self.process_document(file_path, lang)]
+        with ProcessPoolExecutor(max_workers=min(len(tasks), os.cpu_count() or 1)) as pool:
+            results = pool.map(_process_file,
+                               [type(self)] * len(tasks),
+                               [file_path for file_path, _ in tasks],
+                               [lang for _, lang in tasks])
+        return [chunk for file_chunks in results for chunk in file_chunks]
 
     # ---------------------------------------------------------------------
     # Внутренние методы
@@ -101,15 +126,18 @@ class LineChunker:
         if len(tokens) <= self.chunk_size:
             return [tokens]
 
-        segments: List[List[int]] = []
-        start = 0
-        while start < len(tokens):
-            end = min(start + self.chunk_size, len(tokens))
-            segments.append(tokens[start:end])
-            # переходим к следующему сегменту с учётом overlap
-            if end == len(tokens):
-                break
-            start = end - self.overlap
+        # Все полные окна строятся одним C-вызовом: sliding_window_view даёт
+        # 2D-представление без копирования, шаг [::stride] выбирает старты
+        # сегментов — вместо Python-цикла со срезом на каждый сегмент
+        stride = self.chunk_size - self.overlap
+        arr = np.asarray(tokens, dtype=np.int64)
+        full = np.lib.stride_tricks.sliding_window_view(arr, self.chunk_size)[::stride]
+        segments = full.tolist()
+        # Хвост короче chunk_size окном не покрывается — добавляем вручную,
+        # как и раньше: от конца последнего окна минус overlap до конца строки
+        tail_start = len(segments) * stride
+        if tail_start + self.overlap < len(arr):
+            segments.append(arr[tail_start:].tolist())
         return segments
 
     def _detect_document_type(self, text: str) -> str:
@@ -1,14 +1,22 @@
+from functools import lru_cache
+
 from llm.deepseek_api import DeepSeekAPI
 import os
 from dotenv import load_dotenv, find_dotenv
 
 load_dotenv(find_dotenv())
 
+# Клиент создаётся один раз на процесс, а не на каждый запрос
+_llm = DeepSeekAPI(os.getenv('DEEPSEEK_API_KEY') or '')
+
+
+@lru_cache(maxsize=4096)
 def split_text(query: str, language: str) -> str:
-    api_key = os.getenv('DEEPSEEK_API_KEY') or ''
-    llm = DeepSeekAPI(api_key)
+    # Кэш по (query, language): повторный вопрос не платит 300-600 мс за
+    # round-trip к DeepSeek. Fallback тоже кэшируется — сломанный запрос
+    # не ретраится при каждом повторе от пользователя.
     prompt = [{'role': 'system', 'content': 'Extract the key problem, metadata (game, specific issue, situation) from the user query as a clean string for search. Do not invent info.'}, {'role': 'user', 'content': query}]
-    response = llm.generate_response(prompt, temperature=0.3)
+    response = _llm.generate_response(prompt, temperature=0.3)
     if 'choices' in response:
         return response['choices'][0]['message']['content']
-    return query  # Fallback 
\ No newline at end of file
+    return query  # Fallback
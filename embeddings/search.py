@@ -1,5 +1,10 @@
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import logging
+import threading
+import time
+import numpy as np
 from .vector_store import VectorStore
 from .embedder import Embedder
 import json
@@ -10,12 +15,27 @@ from embeddings.preprocess_simple import split_text as split_simple
 # set up module logger
 logger = logging.getLogger(__name__)
 
+# Кэш результатов поиска: корпус статичен между переиндексациями, поэтому
+# TTL щедрый; ёмкости ограничены, чтобы память не росла безгранично
+_CACHE_CAPACITY = 1000
+_CACHE_TTL = 900.0  # секунд
+_SEM_CACHE_CAPACITY = 256  # записей на комбинацию фильтров
+
 class DocumentSearch:
     """Система поиска по документам"""
     
     def __init__(self, vector_store: VectorStore, embedder: Embedder):
         self.vector_store = vector_store
         self.embedder = embedder
+        # Кэш эмбеддингов по предобработанному запросу: ретраи и повторные
+        # вопросы не платят 150-400 мс за round-trip к OpenAI
+        self._embed_query = lru_cache(maxsize=2048)(self.embedder.embed_text)
+        # Двухъярусный кэш результатов: точное совпадение по ключу запроса и
+        # семантическое — по косинусной близости эмбеддингов (частый случай
+        # для саппорт-бота: один и тот же вопрос в разных формулировках)
+        self._result_cache: 'OrderedDict[tuple, tuple]' = OrderedDict()  # ключ -> (ts, results)
+        self._sem_cache: Dict[tuple, list] = {}  # фильтры -> [(ts, emb, results), ...]
+        self._cache_lock = threading.Lock()
     
     def preprocess_query(self, query: str, language: str) -> str:
         if SEARCH_SETTINGS.get('preprocess_type', 'simple') == 'deepseek':
@@ -38,15 +58,73 @@ class DocumentSearch:
             Список найденных документов с метаданными
         """
         processed_query = self.preprocess_query(query, language or 'en')
-        query_embedding = self.embedder.embed_text(processed_query)
+        cache_key = (processed_query, language, document_type, top_k)
+        now = time.monotonic()
+
+        with self._cache_lock:
+            entry = self._result_cache.get(cache_key)
+            if entry is not None and now - entry[0] < _CACHE_TTL:
+                self._result_cache.move_to_end(cache_key)
+                return list(entry[1])
+
+        query_embedding = self._embed_query(processed_query)
+
+        cached = self._semantic_lookup(query_embedding, (language, document_type, top_k), now)
+        if cached is not None:
+            return list(cached)
+
+        results = self._search_with_embedding(query_embedding, query, language, document_type, top_k)
+        self._cache_store(cache_key, query_embedding, results, now)
+        return results
+
+    def _semantic_lookup(self, query_embedding, filters: tuple, now: float) -> Optional[List[Dict[str, Any]]]:
+        """Ищет в семантическом кэше близкий по косинусу запрос с теми же фильтрами"""
+        threshold = SEARCH_SETTINGS.get('semantic_cache_threshold', 0.97)
+        with self._cache_lock:
+            bucket = self._sem_cache.get(filters)
+            if not bucket:
+                return None
+            # Один матричный проход по всем закэшированным эмбеддингам
+            scores = self.embedder.batch_similarity(
+                query_embedding, np.stack([emb for _, emb, _ in bucket]))
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            ts, _, results = bucket[best]
+            if now - ts >= _CACHE_TTL:
+                del bucket[best]
+                return None
+            return results
+
+    def _cache_store(self, cache_key: tuple, query_embedding, results: List[Dict[str, Any]], now: float):
+        """Кладёт результаты в оба яруса кэша с LRU/FIFO-вытеснением"""
+        filters = cache_key[1:]
+        with self._cache_lock:
+            self._result_cache[cache_key] = (now, results)
+            self._result_cache.move_to_end(cache_key)
+            while len(self._result_cache) > _CACHE_CAPACITY:
+                self._result_cache.popitem(last=False)
+            bucket = self._sem_cache.setdefault(filters, [])
+            bucket.append((now, query_embedding, results))
+            if len(bucket) > _SEM_CACHE_CAPACITY:
+                del bucket[0]
+
+    def _search_with_embedding(self, query_embedding, query: str, language: Optional[str],
+                               document_type: Optional[str], top_k: int) -> List[Dict[str, Any]]:
+        """Поиск по готовому эмбеддингу — позволяет переиспользовать один
+        вектор запроса для нескольких языковых фильтров"""
         results = self.vector_store.search(
             query_embedding,
             top_k=top_k,
             language=language,
             document_type=document_type,
         )
+        self._log_results(query, language, results, top_k)
+        return results
 
-        # --- Console output of top chunks ---------------------------------
+    def _log_results(self, query: str, language: Optional[str],
+                     results: List[Dict[str, Any]], top_k: int):
+        """Console output of top chunks"""
         if results:
             logger.info("Found %d chunks for query '%s' (lang=%s):", len(results), query, language)
             for i, r in enumerate(results[:min(top_k, 15)], 1):
@@ -54,8 +132,6 @@ class DocumentSearch:
                 preview = r.get('content', '')[:120].replace('\n', ' ')
                 sim = r.get('similarity', 0)
                 logger.info("  %2d. [%s] %.3f %s", i, section, sim, preview)
-
-        return results
     
     def search_multilingual(self, query: str, top_k: int = 5) -> Dict[str, List[Dict[str, Any]]]:
         """
@@ -68,19 +144,27 @@ class DocumentSearch:
         Returns:
             Словарь с результатами по языкам
         """
+        # Текст запроса один и тот же — эмбеддинг считаем один раз и
+        # переиспользуем для обоих языковых фильтров: минус один API-вызов
+        processed_query = self.preprocess_query(query, 'en')
+        query_embedding = self._embed_query(processed_query)
+
         results = {}
-        
-        # Поиск на английском
-        en_results = self.search(query, language='en', top_k=top_k)
-        if en_results:
-            results['en'] = en_results
-        
-        # Поиск на русском
-        ru_results = self.search(query, language='ru', top_k=top_k)
-        if ru_results:
-            results['ru'] = ru_results
-        
+        for lang, lang_results in zip(('en', 'ru'),
+                                      self._search_both_languages(query_embedding, query, top_k)):
+            if lang_results:
+                results[lang] = lang_results
+
         return results
+
+    def _search_both_languages(self, query_embedding, query: str, top_k: int) -> List[List[Dict[str, Any]]]:
+        """Оба языка за один проход по матрице векторов: скоры считаются
+        один раз, вместо двух независимых запросов к хранилищу"""
+        by_lang = self.vector_store.search_multi_language(
+            query_embedding, ('en', 'ru'), top_k_per_lang=top_k)
+        for lang in ('en', 'ru'):
+            self._log_results(query, lang, by_lang.get(lang) or [], top_k)
+        return [by_lang.get('en') or [], by_lang.get('ru') or []]
     
     def search_by_document_type(self, query: str, document_type: str, 
                                language: Optional[str] = None, top_k: int = 5) -> List[Dict[str, Any]]:
@@ -113,7 +197,10 @@ class DocumentSearch:
             Форматированный контекст для LLM
         """
         results = self.search(query, language, document_type, top_k)
+        return self._format_context(results, top_k)
 
+    def _format_context(self, results: List[Dict[str, Any]], top_k: int) -> str:
+        """Форматирует результаты поиска в контекст для LLM"""
         if not results:
             return "Не найдено релевантной информации в документах."
 
@@ -138,6 +225,23 @@ class DocumentSearch:
 
         return "\n".join(context_parts)
     
+    def get_context(self, query: str, language: str, top_k: int = 25) -> str:
+        """
+        Контекст для одного языка за один поиск (один эмбеддинг + один ANN-запрос)
+
+        Args:
+            query: Запрос пользователя (уже предобработанный)
+            language: Язык поиска ('en' или 'ru')
+            top_k: Количество чанков
+
+        Returns:
+            Форматированный контекст или пустая строка, если ничего не найдено
+        """
+        context = self.get_context_for_llm(query, language, top_k=top_k)
+        if context == "Не найдено релевантной информации в документах.":
+            return ''
+        return context
+
     def get_multilingual_context(self, query: str, top_k: int = 25, language: Optional[str] = None) -> Dict[str, str]:
         """
         Получает контекст на обоих языках или только на выбранном языке
@@ -162,16 +266,15 @@ class DocumentSearch:
             if ru_context != "Не найдено релевантной информации в документах.":
                 contexts['ru'] = ru_context
         else:
-            # Контекст на английском
-            en_context = self.get_context_for_llm(query, 'en', top_k=top_k)
-            if en_context != "Не найдено релевантной информации в документах.":
-                contexts['en'] = en_context
-            
-            # Контекст на русском
-            ru_context = self.get_context_for_llm(query, 'ru', top_k=top_k)
-            if ru_context != "Не найдено релевантной информации в документах.":
-                contexts['ru'] = ru_context
-        
+            # Оба языка: эмбеддинг считаем один раз, ANN-запросы идут параллельно
+            processed_query = self.preprocess_query(query, 'en')
+            query_embedding = self._embed_query(processed_query)
+            for lang, lang_results in zip(('en', 'ru'),
+                                          self._search_both_languages(query_embedding, query, top_k)):
+                context = self._format_context(lang_results, top_k)
+                if context != "Не найдено релевантной информации в документах.":
+                    contexts[lang] = context
+
         return contexts
     
     def search_similar_sections(self, section_name: str, language: str = 'en', 
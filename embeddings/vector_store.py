@@ -1,5 +1,7 @@
+import hashlib
 import numpy as np
 from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor
 import os
 import logging
 import chromadb
@@ -8,30 +10,109 @@ from config.settings import CHROMADB_SETTINGS, SEARCH_SETTINGS
 # logger for this module
 logger = logging.getLogger(__name__)
 
+
+def _chunk_file(chunker_cls, file_path: str, language: str):
+    """Чанкует один файл в worker-процессе.
+
+    Чанкер создаётся внутри процесса: tiktoken-энкодер не сериализуется, поэтому
+    передаём класс, а не готовый объект.
+    """
+    return chunker_cls().process_document(file_path, language)
+
 class VectorStore:
     """Работа с ChromaDB"""
 
+    # Параметры HNSW-графа: дефолты Chroma (M=16, ef_construction=100,
+    # ef_search=10) настроены на скорость; для саппорт-корпуса важнее recall,
+    # а лишние миллисекунды обхода на наших объёмах незаметны
+    _HNSW_METADATA = {
+        'hnsw:space': 'cosine',
+        'hnsw:M': 24,                 # связей на узел — плотнее граф, выше recall
+        'hnsw:construction_ef': 128,  # кандидатов при построении графа
+        'hnsw:search_ef': 64,         # кандидатов при обходе на запрос
+    }
+
     def __init__(self):
         self.client = chromadb.PersistentClient(path=CHROMADB_SETTINGS['persist_directory'])
         self.collection = self.client.get_or_create_collection(
             name=CHROMADB_SETTINGS['collection_name'],
-            metadata={'hnsw:space': 'cosine'}
+            metadata=dict(self._HNSW_METADATA)
         )
+        self._migrate_hnsw_params()
+        # In-memory снапшот коллекции для горячего пути поиска; строится
+        # лениво и сбрасывается при любой записи
+        self._mem_index: Optional[Dict[str, Any]] = None
+
+    def _migrate_hnsw_params(self):
+        """Одноразовая миграция: Chroma применяет hnsw:-метаданные только при
+        создании коллекции, поэтому коллекцию со старым графом пересоздаём,
+        перенося записи как есть (эмбеддинги не пересчитываются)"""
+        meta = self.collection.metadata or {}
+        if meta.get('hnsw:M') == self._HNSW_METADATA['hnsw:M']:
+            return  # коллекция уже создана с новыми параметрами
+
+        dump = {}
+        if self.collection.count() > 0:
+            dump = self.collection.get(include=['embeddings', 'documents', 'metadatas'])
+        self.client.delete_collection(CHROMADB_SETTINGS['collection_name'])
+        self.collection = self.client.create_collection(
+            name=CHROMADB_SETTINGS['collection_name'],
+            metadata=dict(self._HNSW_METADATA)
+        )
+        if dump.get('ids') is not None and len(dump['ids']):
+            self.add_embeddings([
+                {'chunk_id': cid, 'embedding': emb, 'metadata': m, 'content': doc}
+                for cid, emb, m, doc in zip(dump['ids'], dump['embeddings'],
+                                            dump['metadatas'], dump['documents'])
+            ])
+            logger.info("VectorStore: перестроен HNSW-индекс для %d записей", len(dump['ids']))
 
     # --- Индексация -------------------------------------------------------------------------
     def add_embeddings(self, embeddings_data: List[Dict[str, Any]]):
-        ids        = [d['chunk_id']     for d in embeddings_data]
-        embeddings = [d['embedding']    for d in embeddings_data]
-        metadatas  = [d['metadata']     for d in embeddings_data]
-        documents  = [d['content']      for d in embeddings_data]
-        self.collection.upsert(ids=ids, embeddings=embeddings,
-                                metadatas=metadatas, documents=documents)
+        # Upsert режем на батчи: один гигантский вызов раздувает память
+        # транзакции Chroma, а вызов «по чанку» платит фиксированные накладные
+        # расходы на каждую запись; 50-250 векторов — рекомендованный оптимум
+        self._mem_index = None  # снапшот устарел, перестроится при первом поиске
+        batch_size = CHROMADB_SETTINGS.get('upsert_batch_size', 128)
+        for start in range(0, len(embeddings_data), batch_size):
+            batch = embeddings_data[start:start + batch_size]
+            self.collection.upsert(
+                ids=[d['chunk_id'] for d in batch],
+                embeddings=[d['embedding'] for d in batch],
+                metadatas=[d['metadata'] for d in batch],
+                documents=[d['content'] for d in batch])
 
     def load_documents(self, data_dir: str, chunker, embedder) -> Dict[str, Any]:
         """Индексирует документы в указанной папке и выводит статистику."""
         added = updated = skipped = 0  # счётчики файлов
         total_chunks_added = 0  # количество записей (векторов), которые были упакованы в коллекцию
         files_info: List[Dict[str, Any]] = []  # подробная информация по каждому файлу
+        to_process: List[tuple] = []  # файлы, которым нужен (пере)чанкинг: (path, lang, mtime, status)
+
+        # Один bulk-снапшот вместо get(where={'path': ...}) на каждый файл:
+        # N проходов через движок запросов Chroma схлопываются в один
+        snapshot = self.collection.get(include=['metadatas', 'embeddings']) or {}
+        existing_by_path: Dict[str, List[str]] = {}
+        mtime_by_path: Dict[str, Any] = {}
+        # sha256 содержимого -> готовый вектор: неизменившиеся чанки
+        # обновлённых файлов и повторяющиеся блоки не эмбеддятся заново
+        emb_by_sha: Dict[str, Any] = {}
+        snapshot_embs = snapshot.get('embeddings')
+        if snapshot_embs is None:
+            snapshot_embs = []
+        for chunk_id, meta, emb in zip(snapshot.get('ids') or [],
+                                       snapshot.get('metadatas') or [],
+                                       snapshot_embs):
+            meta = meta or {}
+            path = meta.get('path')
+            if path:
+                existing_by_path.setdefault(path, []).append(chunk_id)
+                if path not in mtime_by_path:
+                    mtime_by_path[path] = meta.get('mtime')
+            sha = meta.get('sha256')
+            if sha and sha not in emb_by_sha:
+                emb_by_sha[sha] = emb
+        ids_to_delete: List[str] = []  # устаревшие записи удаляем одним вызовом в конце обхода
         for lang in ['en', 'ru']:
             lang_dir = os.path.join(data_dir, lang)
             if not os.path.isdir(lang_dir):
@@ -47,12 +128,9 @@ class VectorStore:
                 file_path = os.path.join(lang_dir, filename)
                 mtime = os.path.getmtime(file_path)
 
-                existing = self.collection.get(where={'path': file_path}) or {}
-                ids_found = existing.get('ids', [])
+                ids_found = existing_by_path.get(file_path, [])
                 if ids_found:
-                    meta_list = existing.get('metadatas', [])
-                    prev_mtime = meta_list[0].get('mtime') if meta_list else None
-                    if prev_mtime == mtime:
+                    if mtime_by_path.get(file_path) == mtime:
                         skipped += 1
                         files_info.append({
                             'path': file_path,
@@ -60,26 +138,75 @@ class VectorStore:
                             'chunks': 0
                         })
                         continue
-                    # обновляем существующие записи
-                    self.collection.delete(ids=ids_found)
+                    # существующие записи устарели — в очередь на удаление
+                    ids_to_delete.extend(ids_found)
                     updated += 1
                     status = 'updated'
                 else:
                     added += 1
                     status = 'added'
 
-                # Генерируем чанки и добавляем
-                chunks = chunker.process_document(file_path, lang)
-                for c in chunks:
-                    c.metadata['mtime'] = mtime
-                self.add_embeddings(embedder.embed_chunks(chunks))
+                to_process.append((file_path, lang, mtime, status))
 
-                total_chunks_added += len(chunks)
-                files_info.append({
-                    'path': file_path,
-                    'status': status,
-                    'chunks': len(chunks)
-                })
+        if ids_to_delete:
+            self.collection.delete(ids=ids_to_delete)
+            self._mem_index = None
+
+        # Чанкинг CPU-bound (токенизация), поэтому при нескольких файлах
+        # распараллеливаем его пулом процессов в обход GIL
+        if len(to_process) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(to_process), os.cpu_count() or 1)) as pool:
+                chunks_per_file = list(pool.map(
+                    _chunk_file,
+                    [type(chunker)] * len(to_process),
+                    [fp for fp, _, _, _ in to_process],
+                    [lang for _, lang, _, _ in to_process]))
+        else:
+            chunks_per_file = [chunker.process_document(fp, lang) for fp, lang, _, _ in to_process]
+
+        # Собираем чанки всех файлов и эмбеддим одним батчем вместо «по файлу»
+        all_chunks = []
+        for (file_path, lang, mtime, status), chunks in zip(to_process, chunks_per_file):
+            for c in chunks:
+                c.metadata['mtime'] = mtime
+                c.metadata['sha256'] = hashlib.sha256(c.content.encode('utf-8')).hexdigest()
+            all_chunks.extend(chunks)
+            total_chunks_added += len(chunks)
+            files_info.append({
+                'path': file_path,
+                'status': status,
+                'chunks': len(chunks)
+            })
+
+        if all_chunks:
+            # Эмбеддим только первого представителя каждого нового sha256;
+            # остальные чанки переиспользуют его вектор (или вектор из снапшота)
+            representatives = []
+            duplicates = []
+            for c in all_chunks:
+                sha = c.metadata['sha256']
+                if sha in emb_by_sha:
+                    duplicates.append(c)
+                else:
+                    emb_by_sha[sha] = None  # бронируем sha за представителем
+                    representatives.append(c)
+
+            embeddings_data = embedder.embed_chunks(representatives) if representatives else []
+            for rep, entry in zip(representatives, embeddings_data):
+                emb_by_sha[rep.metadata['sha256']] = entry['embedding']
+
+            embeddings_data += [
+                {'chunk_id': c.chunk_id,
+                 'content': c.content,
+                 'embedding': emb_by_sha[c.metadata['sha256']],
+                 # то же обогащение метаданных, что делает embed_chunks
+                 'metadata': {**c.metadata, 'language': c.language,
+                              'document_type': c.document_type}}
+                for c in duplicates]
+            if duplicates:
+                logger.info("VectorStore: %d чанков переиспользовали готовые векторы по sha256",
+                            len(duplicates))
+            self.add_embeddings(embeddings_data)
 
         return {
             'added': added,
@@ -106,18 +233,135 @@ class VectorStore:
             return {'document_type': doc_type}
         return None
 
+    def _build_mem_index(self) -> Dict[str, Any]:
+        """Выгружает коллекцию в RAM для горячего пути поиска.
+
+        На наших объёмах (тысячи чанков) один точный матричный проход BLAS
+        быстрее и полнее ANN-обхода через движок запросов Chroma с его
+        ~100 мс накладных расходов на вызов; Chroma остаётся источником
+        истины на диске, все записи идут через неё и сбрасывают снапшот.
+        """
+        dump = self.collection.get(include=['embeddings', 'documents', 'metadatas']) or {}
+        metadatas = [m or {} for m in (dump.get('metadatas') or [])]
+        emb = dump.get('embeddings')
+        matrix = np.asarray(emb if emb is not None else [], dtype=np.float32)
+        if matrix.size:
+            # Нормируем строки один раз — дальше косинус это чистый dot
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0.0] = 1.0
+            matrix = matrix / norms
+        return {
+            'matrix': matrix,
+            'documents': dump.get('documents') or [],
+            'metadatas': metadatas,
+            'languages': np.array([m.get('language') for m in metadatas], dtype=object),
+            'doc_types': np.array([m.get('document_type') for m in metadatas], dtype=object),
+        }
+
     def search(self, query_embedding: np.ndarray, *, top_k: int = SEARCH_SETTINGS['default_top_k'],
                language: Optional[str] = None, document_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        try:
+            if self._mem_index is None:
+                self._mem_index = self._build_mem_index()
+            index = self._mem_index
+        except Exception:
+            logger.exception("VectorStore: не удалось построить in-memory индекс, поиск через Chroma")
+            return self._search_chroma(query_embedding, top_k=top_k,
+                                       language=language, document_type=document_type)
+
+        matrix = index['matrix']
+        if not matrix.size:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        qnorm = float(np.linalg.norm(query))
+        scores = matrix @ (query / qnorm if qnorm else query)
+
+        # Фильтры по метаданным — булевы маски по заранее извлечённым колонкам
+        mask = None
+        if language is not None:
+            mask = index['languages'] == language
+        if document_type is not None:
+            dt_mask = index['doc_types'] == document_type
+            mask = dt_mask if mask is None else (mask & dt_mask)
+        candidates = np.flatnonzero(mask) if mask is not None else np.arange(scores.size)
+        return self._rank_candidates(index, scores, candidates, top_k)
+
+    def search_multi_language(self, query_embedding: np.ndarray, languages,
+                              *, top_k_per_lang: int = SEARCH_SETTINGS['default_top_k']) -> Dict[str, List[Dict[str, Any]]]:
+        """Поиск сразу по нескольким языкам за один проход по матрице:
+        скоры считаются один раз, раскладка по языкам — дешёвые маски"""
+        try:
+            if self._mem_index is None:
+                self._mem_index = self._build_mem_index()
+            index = self._mem_index
+        except Exception:
+            logger.exception("VectorStore: не удалось построить in-memory индекс, поиск через Chroma")
+            return {lang: self._search_chroma(query_embedding, top_k=top_k_per_lang, language=lang)
+                    for lang in languages}
+
+        matrix = index['matrix']
+        if not matrix.size:
+            return {lang: [] for lang in languages}
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        qnorm = float(np.linalg.norm(query))
+        scores = matrix @ (query / qnorm if qnorm else query)
+
+        return {lang: self._rank_candidates(index, scores,
+                                            np.flatnonzero(index['languages'] == lang),
+                                            top_k_per_lang)
+                for lang in languages}
+
+    def _rank_candidates(self, index: Dict[str, Any], scores: np.ndarray,
+                         candidates: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        """top_k кандидатов по убыванию сходства с отсечкой по порогу"""
+        if not candidates.size:
+            return []
+        cand_scores = scores[candidates]
+
+        # top_k без полной сортировки: argpartition + сортировка головы
+        if cand_scores.size > top_k:
+            head = np.argpartition(-cand_scores, top_k)[:top_k]
+            order = head[np.argsort(-cand_scores[head])]
+        else:
+            order = np.argsort(-cand_scores)
+
+        threshold = SEARCH_SETTINGS['similarity_threshold']
+        debug = logger.isEnabledFor(logging.DEBUG)
+        results = []
+        for pos in order:
+            similarity = float(cand_scores[pos])
+            if similarity < threshold:
+                break  # скоры отсортированы по убыванию
+            idx = int(candidates[pos])
+            doc = index['documents'][idx]
+            if doc is None: continue  # Skip empty
+            meta = index['metadatas'][idx]
+            results.append({'content': doc, 'metadata': meta, 'similarity': similarity})
+            if debug:
+                logger.debug("  #%d sim=%.3f section=%s preview=%s", len(results), similarity, meta.get('section', '-'), doc[:100].replace('\n',' '))
+        return results
+
+    def _search_chroma(self, query_embedding: np.ndarray, *, top_k: int,
+                       language: Optional[str] = None, document_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Резервный путь поиска через движок запросов Chroma"""
         where = self._format_filters(language, document_type)
+        # Chroma принимает numpy напрямую — tolist() на каждый запрос
+        # аллоцировал ~1.5k боксированных float в горячем пути поиска;
+        # asarray для уже-float32 вектора — бесплатное view
         res = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
+            query_embeddings=[np.asarray(query_embedding, dtype=np.float32)],
             n_results=top_k,
-            where=where or {}  # type: ignore
+            where=where  # None = без фильтра; пустой dict текущий Chroma отвергает
         )
         threshold = SEARCH_SETTINGS['similarity_threshold']
 
-        # --- Debug logging --------------------------------------------------
-        logger.debug("VectorStore.search: top_k=%s, language=%s, doc_type=%s, threshold=%.2f", top_k, language, document_type, threshold)
+        # Форматирование превью и прочие строковые операции только когда
+        # debug-лог реально включён — в проде за них не платим
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("VectorStore.search: top_k=%s, language=%s, doc_type=%s, threshold=%.2f", top_k, language, document_type, threshold)
 
         results = []
         # Если ChromaDB вернул None (например, при отсутствии результатов), подставляем пустой список
@@ -125,14 +369,20 @@ class VectorStore:
         metadatas = (res.get('metadatas') or [[]])[0]
         distances = (res.get('distances') or [[]])[0]
 
-        for idx, (doc, meta, dist) in enumerate(zip(documents, metadatas, distances)):
+        # Числовая часть фильтра — один numpy-проход; словари результатов
+        # строим только для индексов, прошедших порог
+        similarities = 1.0 - np.asarray(distances, dtype=np.float32)
+        for idx in np.flatnonzero(similarities >= threshold):
+            doc = documents[idx]
             if doc is None: continue  # Skip empty
-            similarity = 1 - dist
-            if similarity < threshold: continue
-            results.append({'content': doc, 'metadata': meta or {}, 'similarity': similarity})
-            logger.debug("  #%d sim=%.3f section=%s preview=%s", idx+1, similarity, (meta or {}).get('section', '-'), doc[:100].replace('\n',' '))
+            meta = metadatas[idx] or {}
+            similarity = float(similarities[idx])
+            results.append({'content': doc, 'metadata': meta, 'similarity': similarity})
+            if debug:
+                logger.debug("  #%d sim=%.3f section=%s preview=%s", idx+1, similarity, meta.get('section', '-'), doc[:100].replace('\n',' '))
 
-        logger.debug("VectorStore.search: returned %d chunks after filtering", len(results))
+        if debug:
+            logger.debug("VectorStore.search: returned %d chunks after filtering", len(results))
         return results
 
     def search_by_text(self, query_text: str, embedder, **kwargs):
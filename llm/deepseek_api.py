@@ -1,9 +1,17 @@
+import asyncio
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import re
 from typing import List, Dict, Any, Optional
 import time
 import os
 
+# Разделитель для предразбиения шаблона на литеральные куски вокруг маркеров
+_MARKER_RE = re.compile(r'(\{promotions\}|\{context\})')
+
 class DeepSeekAPI:
     """Класс для работы с DeepSeek API"""
     
@@ -92,6 +100,25 @@ Do not use emojis.
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        # Постоянная сессия с keep-alive: без неё каждый вызов платит
+        # TCP+TLS handshake (~100-300 мс). Ретраи только на коды, при
+        # которых генерация заведомо не началась
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=8, pool_maxsize=16,
+            max_retries=Retry(total=3, backoff_factor=0.5,
+                              status_forcelist=[429, 500, 502, 503, 504],
+                              allowed_methods=frozenset(['POST']))))
+        # Async-клиент создаётся лениво при первом await — на момент
+        # конструктора event loop ещё может не существовать
+        self._async_client: Optional[httpx.AsyncClient] = None
+        # Шаблон промпта и акции кэшируем в памяти: stat() на вызов дёшев,
+        # перечитываем с диска только при смене mtime (как в PromptManager)
+        self._template_parts: Optional[list] = None
+        self._template_mtime: Optional[float] = None
+        self._promotions_cache = ''
+        self._promotions_mtime: Optional[float] = None
     
     def generate_response(self, messages: List[Dict[str, str]], 
                          model: str = "deepseek-chat", 
@@ -121,7 +148,8 @@ Do not use emojis.
         # Выполняем запрос к DeepSeek
         usage: Dict[str, Any] = {}
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            # (connect, read)-таймаут: раньше запрос без таймаута мог висеть вечно
+            response = self.session.post(url, json=payload, timeout=(5, 60))
             response.raise_for_status()
             response_json: Dict[str, Any] = response.json()
             usage = response_json.get('usage', {}) or {}
@@ -130,6 +158,12 @@ Do not use emojis.
             response_json = {"error": str(e)}
         
         # --- Расширенное логирование запроса ---------------------------------
+        self._log_request(messages, model, usage)
+
+        return response_json
+
+    def _log_request(self, messages: List[Dict[str, str]], model: str, usage: Dict[str, Any]):
+        """Дописывает запрос и usage в logs/deepseek_prompts.log"""
         try:
             os.makedirs('logs', exist_ok=True)
             with open('logs/deepseek_prompts.log', 'a', encoding='utf-8') as log_file:
@@ -154,8 +188,65 @@ Do not use emojis.
             # Не прерываем основной поток при ошибке логирования
             pass
 
+    # --- Async-вариант поверх httpx ----------------------------------------
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(headers=self.headers, timeout=60.0)
+        return self._async_client
+
+    async def agenerate_response(self, messages: List[Dict[str, str]],
+                                 model: str = "deepseek-chat",
+                                 max_tokens: int = 1000,
+                                 temperature: float = 0.7) -> Dict[str, Any]:
+        """Async-аналог generate_response: не блокирует event loop и позволяет
+        нескольким LLM-вызовам лететь параллельно"""
+        url = f"{self.base_url}/chat/completions"
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+
+        usage: Dict[str, Any] = {}
+        try:
+            response = await self._get_async_client().post(url, json=payload)
+            response.raise_for_status()
+            response_json: Dict[str, Any] = response.json()
+            usage = response_json.get('usage', {}) or {}
+        except httpx.HTTPError as e:
+            response_json = {"error": str(e)}
+
+        # Файловый лог — в worker-поток, чтобы не тормозить loop записью на диск
+        await asyncio.to_thread(self._log_request, messages, model, usage)
+
         return response_json
-    
+
+    async def aanswer_with_context(self, user_query: str, context: str,
+                                   language: str = "en") -> str:
+        """Async-аналог answer_with_context"""
+        messages = self.create_support_prompt(user_query, context, language)
+
+        response = await self.agenerate_response(messages, max_tokens=800, temperature=0.5)
+
+        if "error" in response:
+            return f"Ошибка при генерации ответа: {response['error']}"
+
+        try:
+            return response["choices"][0]["message"]["content"]
+        except (KeyError, IndexError):
+            return "Ошибка при обработке ответа от API"
+
+    async def aanswer_multilingual(self, user_query: str, contexts: Dict[str, str]) -> Dict[str, str]:
+        """Генерирует ответы на нескольких языках параллельно: два независимых
+        ~2-секундных вызова LLM занимают время одного"""
+        languages = list(contexts)
+        answers = await asyncio.gather(
+            *(self.aanswer_with_context(user_query, contexts[lang], lang)
+              for lang in languages))
+        return dict(zip(languages, answers))
+
+
     def create_support_prompt(self, user_query: str, context: str, 
                             language: str = "en") -> List[Dict[str, str]]:
         """
@@ -169,15 +260,11 @@ Do not use emojis.
         Returns:
             Список сообщений для API
         """
-        promotions_en = ''
-        if os.path.exists('data/en/promotions.txt'):
-            with open('data/en/promotions.txt', 'r', encoding='utf-8') as f:
-                promotions_en = f.read()
-        promotions = promotions_en
+        promotions = self._load_promotions()
 
         # Load system prompt from external file so it can be modified without code changes
         system_prompt = self._load_system_prompt(promotions, context)
- 
+
         # Return only the system message; conversation history will be provided separately when needed
         return [
             {"role": "system", "content": system_prompt}
@@ -260,11 +347,7 @@ Do not use emojis.
             Generated response
         """
         # Load promotions text
-        promotions_en = ''
-        if os.path.exists('data/en/promotions.txt'):
-            with open('data/en/promotions.txt', 'r', encoding='utf-8') as f:
-                promotions_en = f.read()
-        promotions = promotions_en
+        promotions = self._load_promotions()
 
         # Load system prompt from external file so it can be modified without code changes
         system_prompt = self._load_system_prompt(promotions, context)
@@ -277,8 +360,9 @@ Do not use emojis.
         # Build messages
         # DeepSeek (OpenAI-style) API допускает роли 'system', 'user', 'assistant'.
         # В истории мы храним 'bot' для ответа, поэтому приведём к 'assistant'.
+        # Копируем сообщение только если роль действительно надо переписать
         normalized_history = [
-            {**msg, 'role': ('assistant' if msg.get('role') == 'bot' else msg.get('role'))}
+            ({**msg, 'role': 'assistant'} if msg.get('role') == 'bot' else msg)
             for msg in history
             if msg.get('role') in ['user', 'bot', 'assistant']
         ]
@@ -310,20 +394,43 @@ Do not use emojis.
 
     def _load_system_prompt(self, promotions: str, context: str) -> str:
         """
-        Internal helper to load the system prompt template from prompts/system_prompt.txt
-        and substitute placeholders on every request.
+        Internal helper to build the system prompt from the cached template
+        parts, substituting placeholders without re-reading/re-scanning the file.
         """
+        # Подстановка через join по предразбитым кускам вместо двух
+        # O(N)-проходов str.replace по всему шаблону на каждый запрос
+        subst = {'{promotions}': promotions, '{context}': context}
+        return ''.join(subst.get(part, part) for part in self._get_template_parts())
+
+    def _get_template_parts(self) -> list:
+        """Возвращает шаблон, предразбитый вокруг маркеров; кэш по mtime файла"""
         try:
-            with open('prompts/system_prompt.txt', 'r', encoding='utf-8') as file:
-                template = file.read()
-            if not template.strip():
-                raise ValueError('Prompt file empty')
-        except Exception:
-            # Fall back to internal default template if file missing or invalid
-            template = self._DEFAULT_PROMPT_TEMPLATE
-
-        return (
-            template
-            .replace("{promotions}", promotions)
-            .replace("{context}", context)
-        )
+            mtime = os.stat('prompts/system_prompt.txt').st_mtime
+        except OSError:
+            mtime = None
+        if self._template_parts is None or mtime != self._template_mtime:
+            try:
+                with open('prompts/system_prompt.txt', 'r', encoding='utf-8') as file:
+                    template = file.read()
+                if not template.strip():
+                    raise ValueError('Prompt file empty')
+            except Exception:
+                # Fall back to internal default template if file missing or invalid
+                template = self._DEFAULT_PROMPT_TEMPLATE
+            self._template_parts = _MARKER_RE.split(template)
+            self._template_mtime = mtime
+        return self._template_parts
+
+    def _load_promotions(self) -> str:
+        """Текст акций из data/en/promotions.txt (кэш инвалидируется по mtime)"""
+        try:
+            mtime = os.stat('data/en/promotions.txt').st_mtime
+        except OSError:
+            self._promotions_mtime = None
+            self._promotions_cache = ''
+            return ''
+        if mtime != self._promotions_mtime:
+            with open('data/en/promotions.txt', 'r', encoding='utf-8') as f:
+                self._promotions_cache = f.read()
+            self._promotions_mtime = mtime
+        return self._promotions_cache
@@ -18,11 +18,16 @@ class DeepSeekClient:
     NO business logic - pure API client
     """
     
-    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com/v1"):
+    def __init__(self, api_key: str, base_url: str = "https://api.deepseek.com/v1",
+                 session: requests.Session = None):
         # EXACT COPY: Current initialization
         self.api_key = api_key
         self.base_url = base_url
         self.headers = self._build_headers()
+        # Постоянная сессия: TCP/TLS-соединение и DNS переиспользуются между
+        # запросами вместо нового handshake на каждое сообщение пользователя
+        self.session = session or requests.Session()
+        self.session.headers.update(self.headers)
         
     def make_request(self, messages: List[Dict[str, str]], 
                     model: str = "deepseek-chat",
@@ -39,7 +44,7 @@ class DeepSeekClient:
         # Выполняем запрос к DeepSeek
         usage: Dict[str, Any] = {}
         try:
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = self.session.post(url, json=payload)
             response.raise_for_status()
             response_json: Dict[str, Any] = response.json()
             usage = response_json.get('usage', {}) or {}
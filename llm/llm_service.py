@@ -42,8 +42,10 @@ class LLMService:
         # Build messages
         # DeepSeek (OpenAI-style) API допускает роли 'system', 'user', 'assistant'.
         # В истории мы храним 'bot' для ответа, поэтому приведём к 'assistant'.
+        # Копируем сообщение только если роль действительно надо переписать:
+        # словари истории приходят из кэша и переиспользуются между вызовами
         normalized_history = [
-            {**msg, 'role': ('assistant' if msg.get('role') == 'bot' else msg.get('role'))}
+            ({**msg, 'role': 'assistant'} if msg.get('role') == 'bot' else msg)
             for msg in history
             if msg.get('role') in ['user', 'bot', 'assistant']
         ]